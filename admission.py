@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Lower number is served first when ask() slots are contended
+PRIORITIES = {'voice': 0, 'whatsapp': 1, 'email': 2}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self) -> float:
+        # Takes a token even if it has not been refilled yet and returns how
+        # long until it is, so reservations queue up behind each other
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queue: int = 16,
+        queue_timeout: float = 5.0,
+        sender_rate: float = 0.2,
+        sender_burst: int = 5,
+        max_senders: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.max_senders = max_senders
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._buckets = {}
+        self._active = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._counts = {'admitted': 0, 'queued': 0, 'shed': 0, 'rate_limited': 0, 'delayed': 0}
+
+    def _bucket(self, sender: str) -> TokenBucket:
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            # Forget full buckets first so the table stays bounded
+            if len(self._buckets) >= self.max_senders:
+                self._prune_buckets()
+            bucket = self._buckets[sender] = TokenBucket(self.sender_rate, self.sender_burst)
+        return bucket
+
+    def allow_sender(self, sender: str) -> bool:
+        with self._lock:
+            if self._bucket(sender).take():
+                return True
+            self._counts['rate_limited'] += 1
+            return False
+
+    def reserve_sender(self, sender: str) -> float:
+        # For work that can wait rather than be dropped: returns the seconds
+        # until this sender's next token, which is already taken
+        with self._lock:
+            delay = self._bucket(sender).reserve()
+            if delay > 0:
+                self._counts['delayed'] += 1
+            return delay
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for sender, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self._buckets[sender]
+
+    @contextmanager
+    def slot(self, channel: str, timeout: float = None):
+        # timeout bounds the time spent queued; defaults to queue_timeout
+        admitted = self._acquire(PRIORITIES.get(channel, len(PRIORITIES)), self.queue_timeout if timeout is None else timeout)
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self._release()
+
+    def _acquire(self, priority: int, timeout: float) -> bool:
+        with self._condition:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._counts['admitted'] += 1
+                return True
+            if len(self._waiting) >= self.max_queue:
+                self._counts['shed'] += 1
+                return False
+
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            self._counts['queued'] += 1
+            deadline = time.monotonic() + timeout
+            while not (self._waiting[0] == entry and self._active < self.max_concurrent):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._counts['shed'] += 1
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self._counts['admitted'] += 1
+            self._condition.notify_all()
+            return True
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counts,
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+            }
@@ -1,20 +1,34 @@
 import os
-import ast
 import json
+import math
+import atexit
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 from scipy import spatial
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_file
 from twilio.twiml.voice_response import VoiceResponse
 from twilio.rest import Client
 import tiktoken
-from openai import OpenAI
+from openai import OpenAI, OpenAIError
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 from textblob import TextBlob
 import sendgrid
 from sendgrid.helpers.mail import Mail
 from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
+from sendgrid.helpers.mail import Mail, Email, To, Content, Personalization, Substitution
+from context_packing import mmr_select, MIN_RELATEDNESS
+from admission import AdmissionController
+from resilience import CircuitBreaker, Deadline, OpenAIUnavailable, resilient_call
+from embedding_store import EmbeddingStore
+from knowledge_base import KnowledgeBaseManager
+from idempotency import IdempotencyCache
+from followups import FollowUpScheduler
+from pitches import PitchLibrary, BuildInProgress, library_version, in_off_peak
+from profiling import RequestProfiler
 
 
 load_dotenv()
@@ -59,47 +73,149 @@ with open('customer_trades.json') as f:
 with open('customer_emails.json') as f:
     customer_emails = json.load(f)
 
+with open('message_state.json') as f:
+    message_state = json.load(f)
+message_state_lock = threading.Lock()
+
 embeddings_path = "DATASET/emdeddings_dataset.csv"
-df = pd.read_csv(embeddings_path)
-df['embedding'] = df['embedding'].apply(ast.literal_eval)
+
+# With EMBEDDINGS_SHARED_MEMORY=1 the embedding matrix and texts live in one
+# shared memory segment per dataset version. Load the app in the master
+# (e.g. gunicorn --preload) and the workers attach to it instead of each
+# parsing their own copy of the CSV.
+def load_embeddings(path):
+    if os.getenv("EMBEDDINGS_SHARED_MEMORY") == "1":
+        return EmbeddingStore.shared(path)
+    return EmbeddingStore.from_csv(path)
+
+# The knowledge base is reloaded in the background whenever the dataset
+# changes; set KB_POLL_SECONDS=0 to turn the watcher off
+KB_POLL_SECONDS = float(os.getenv("KB_POLL_SECONDS", 30))
+knowledge_base = KnowledgeBaseManager(embeddings_path, load_embeddings, poll_interval=KB_POLL_SECONDS)
+if KB_POLL_SECONDS > 0:
+    knowledge_base.start()
+    # Threads don't survive fork, so preforked workers start their own watcher
+    os.register_at_fork(after_in_child=knowledge_base.after_fork)
 
 # Defining models and API keys
 EMBEDDING_MODEL = "text-embedding-3-small"
 GPT_MODEL = "gpt-3.5-turbo"
 
+# Admission control for the LLM-backed webhooks
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ASK_MAX_CONCURRENT", 4)),
+    max_queue=int(os.getenv("ASK_MAX_QUEUE", 16)),
+    sender_rate=float(os.getenv("SENDER_RATE_PER_SECOND", 0.2)),
+    sender_burst=int(os.getenv("SENDER_BURST", 5)),
+)
+OVERLOAD_MESSAGE = "Sorry, we are handling a lot of requests right now. Please try again in a few minutes, or contact our number, 0 7 7 8 0 4 0 4 9 7 3 or visit our website (www.starinternational.co.zw) for more information."
+
+# Deadlines and circuit breaker for the OpenAI calls. Twilio gives up on a
+# webhook after 15 seconds, so a turn has to answer well within that.
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE_SECONDS", 10))
+EMBEDDING_SHARE = 0.2
+EMBEDDING_TIMEOUT = 3.0
+EMBEDDING_HEDGE_AFTER = 1.0
+openai_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("OPENAI_FAILURE_THRESHOLD", 5)),
+    reset_timeout=float(os.getenv("OPENAI_RESET_TIMEOUT", 30)),
+)
+# Twilio retries webhooks that time out; replay the first response instead
+webhook_responses = IdempotencyCache(ttl=float(os.getenv("WEBHOOK_IDEMPOTENCY_TTL", 300)))
+# A duplicate waits at most about one turn for the original; Twilio itself
+# gives up on a webhook after 15 seconds
+WEBHOOK_DUPLICATE_WAIT = TURN_DEADLINE + 2
+
+# Chunks less related to the query than this are left out of the prompt
+CONTEXT_MIN_RELATEDNESS = float(os.getenv("CONTEXT_MIN_RELATEDNESS", MIN_RELATEDNESS))
+
+# Bulk email ingestion
+BULK_EMAIL_WORKERS = int(os.getenv("BULK_EMAIL_WORKERS", 8))
+EMAIL_SEND_BATCH_SIZE = int(os.getenv("EMAIL_SEND_BATCH_SIZE", 100))
+# Emails from senders over their rate limit are held back, not dropped; past
+# this many held emails reading the upload pauses until some are released
+BULK_EMAIL_MAX_DELAYED = int(os.getenv("BULK_EMAIL_MAX_DELAYED", 1000))
+
+# Query embeddings are deterministic, so repeated queries skip the API
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+query_embedding_cache = {}
+query_embedding_cache_lock = threading.Lock()
+
+REFERRAL_MESSAGE = "Sorry, I can not fully answer that, instead let me refer you to my colleague, who will reach out shortly, if they delay please, contact our number, 0 7 7 8 0 4 0 4 9 7 3 or visit our website (www.starinternational.co.zw) for more information."
+
 # Helper Functions
+def query_embedding_for(query: str, timeout: float = EMBEDDING_TIMEOUT) -> list[float]:
+    with query_embedding_cache_lock:
+        cached = query_embedding_cache.get(query)
+    if cached is not None:
+        return cached
+
+    # Embeddings are cheap, so a slow request is hedged with a second one
+    def create(attempt_timeout):
+        return openai_client.with_options(timeout=attempt_timeout, max_retries=0).embeddings.create(
+            model=EMBEDDING_MODEL, input=query,
+        )
+    query_embedding_response = resilient_call(create, openai_breaker, timeout, hedge_after=EMBEDDING_HEDGE_AFTER)
+    query_embedding = query_embedding_response.data[0].embedding
+
+    with query_embedding_cache_lock:
+        if len(query_embedding_cache) >= QUERY_EMBEDDING_CACHE_SIZE:
+            query_embedding_cache.pop(next(iter(query_embedding_cache)))
+        query_embedding_cache[query] = query_embedding
+    return query_embedding
+
+def rows_ranked_by_relatedness(
+    query_embedding: list[float],
+    df: pd.DataFrame,
+    relatedness_fn=lambda x, y: 1 - spatial.distance.cosine(x, y),
+    top_n: int = 100
+) -> tuple[list[str], list[float], list[list[float]]]:
+    # The shared store keeps normalized vectors and always ranks by cosine
+    if isinstance(df, EmbeddingStore):
+        return df.ranked(query_embedding, top_n)
+    rows_and_relatednesses = [
+        (row["text"], relatedness_fn(query_embedding, row["embedding"]), row["embedding"])
+        for i, row in df.iterrows()
+    ]
+    rows_and_relatednesses.sort(key=lambda x: x[1], reverse=True)
+    strings, relatednesses, embeddings = zip(*rows_and_relatednesses[:top_n])
+    return strings, relatednesses, embeddings
+
 def strings_ranked_by_relatedness(
     query: str,
     df: pd.DataFrame,
     relatedness_fn=lambda x, y: 1 - spatial.distance.cosine(x, y),
     top_n: int = 100
 ) -> tuple[list[str], list[float]]:
-    query_embedding_response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL, input=query,
-    )
-    query_embedding = query_embedding_response.data[0].embedding
-    strings_and_relatednesses = [
-        (row["text"], relatedness_fn(query_embedding, row["embedding"]))
-        for i, row in df.iterrows()
-    ]
-    strings_and_relatednesses.sort(key=lambda x: x[1], reverse=True)
-    strings, relatednesses = zip(*strings_and_relatednesses)
-    return strings[:top_n], relatednesses[:top_n]
+    query_embedding = query_embedding_for(query)
+    strings, relatednesses, _ = rows_ranked_by_relatedness(query_embedding, df, relatedness_fn, top_n)
+    return strings, relatednesses
 
 def num_tokens(text: str, model: str = GPT_MODEL) -> int:
     encoding = tiktoken.encoding_for_model(model)
     return len(encoding.encode(text))
 
 def query_message(
-    query: str, df: pd.DataFrame, model: str, token_budget: int
+    query: str, df: pd.DataFrame, model: str, token_budget: int, pack_context: bool = True,
+    deadline: Deadline = None,
 ) -> str:
-    strings, relatednesses = strings_ranked_by_relatedness(query, df)
-    
+    if deadline is None:
+        query_embedding = query_embedding_for(query)
+    else:
+        query_embedding = query_embedding_for(query, timeout=deadline.stage(EMBEDDING_SHARE))
+    strings, relatednesses, embeddings = rows_ranked_by_relatedness(query_embedding, df)
+
     # Log ranked strings and relatedness scores
     app.logger.info(f"Ranked strings: {strings}")
     app.logger.info(f"Relatedness scores: {relatednesses}")
 
-    introduction = 'Use the below information from Star International. Answer as a virtual assistant and marketing agent for the company. Try your best to answer all the questions using the provided information. If the answer cannot be found in the info, write "Sorry, I can not fully answer that, instead let me refer you to my colleague, who will reach out shortly, if they delay please, contact our number, 0 7 7 8 0 4 0 4 9 7 3 or visit our website (www.starinternational.co.zw) for more information."'
+    # Pack the context: rerank by MMR, drop near-duplicates and weak matches
+    if pack_context:
+        selected = mmr_select(query_embedding, embeddings, min_relatedness=CONTEXT_MIN_RELATEDNESS)
+        app.logger.info(f"Context packing kept {len(selected)} of {len(strings)} chunks")
+        strings = [strings[i] for i in selected]
+
+    introduction = 'Use the below information from Star International. Answer as a virtual assistant and marketing agent for the company. Try your best to answer all the questions using the provided information. If the answer cannot be found in the info, write "' + REFERRAL_MESSAGE + '"'
     question = f"\n\nQuestion: {query}"
     message = introduction
     for string in strings:
@@ -117,19 +233,42 @@ def query_message(
     return final_message
 
 def ask(
-    query: str, df: pd.DataFrame = df,
+    query: str, df: pd.DataFrame = None,
     model: str = GPT_MODEL, token_budget: int = 4096 - 500, print_message: bool = False,
+    pack_context: bool = True, channel: str = None, deadline: Deadline = None,
 ) -> str:
-    message = query_message(query, df, model=model, token_budget=token_budget)
-    if print_message:
-        print(message)
-    messages = [
-        {"role": "system", "content": "You answer questions about Star International and persuade customers to use the transporting services. Be friendly and empathetic."},
-        {"role": "user", "content": message},
-    ]
-    response = openai_client.chat.completions.create(model=model, messages=messages, temperature=0)
-    response_message = response.choices[0].message.content
-    
+    # The turn budget starts before queueing so time spent waiting counts too
+    if deadline is None:
+        deadline = Deadline(TURN_DEADLINE)
+    # Pin this turn to the knowledge base version active when it started
+    if df is None:
+        df = knowledge_base.active.data
+
+    # Queueing for a slot can use at most what is left of the turn budget
+    with admission.slot(channel, timeout=deadline.remaining()) as admitted:
+        if not admitted:
+            app.logger.warning(f"ask() shed under overload for channel {channel}")
+            return OVERLOAD_MESSAGE
+
+        try:
+            message = query_message(query, df, model=model, token_budget=token_budget, pack_context=pack_context, deadline=deadline)
+            if print_message:
+                print(message)
+            messages = [
+                {"role": "system", "content": "You answer questions about Star International and persuade customers to use the transporting services. Be friendly and empathetic."},
+                {"role": "user", "content": message},
+            ]
+
+            def create(attempt_timeout):
+                return openai_client.with_options(timeout=attempt_timeout, max_retries=0).chat.completions.create(
+                    model=model, messages=messages, temperature=0,
+                )
+            response = resilient_call(create, openai_breaker, deadline.remaining())
+            response_message = response.choices[0].message.content
+        except (OpenAIUnavailable, OpenAIError) as e:
+            app.logger.warning(f"OpenAI unavailable, falling back to referral message: {e!r}")
+            return REFERRAL_MESSAGE
+
     # Logging the response from OpenAI
     app.logger.info(f"Response from OpenAI: {response_message}")
     
@@ -144,6 +283,32 @@ def get_customer_status(phone_number):
         return "uknown"
 
 
+def webhook_idempotency_key(response_type):
+    if response_type == 'voice':
+        call_sid = request.values.get('CallSid')
+        if not call_sid:
+            return None
+        # Twilio does not number the turns of a call; each gather action
+        # carries ?seq=N and turns without it are not cached
+        sequence = request.args.get('seq', type=int)
+        if sequence is None:
+            return None
+        return f"voice:{call_sid}:{sequence}"
+    message_sid = request.values.get('MessageSid')
+    return f"{response_type}:{message_sid}" if message_sid else None
+
+def idempotent(key, compute, busy):
+    # busy() answers a duplicate whose original is still running after
+    # WEBHOOK_DUPLICATE_WAIT, rather than holding the worker any longer
+    if key is None:
+        return compute()
+    try:
+        return webhook_responses.get_or_compute(key, compute, timeout=WEBHOOK_DUPLICATE_WAIT)
+    except TimeoutError:
+        app.logger.warning(f"Duplicate webhook {key} still being processed, answering with the overload message")
+        return busy()
+
+
 def send_email(to_email, subject, content):
     sg = SendGridAPIClient(api_key=os.getenv('SENDGRID_API_KEY'))
     from_email = Email('emeldam@starinternational.co.zw')
@@ -153,12 +318,164 @@ def send_email(to_email, subject, content):
     response = sg.send(mail)
     return response
 
-# Global Variables
-interaction_counter = 0
+def send_email_batch(replies):
+    # One SendGrid request for many replies: the body is a substitution, so
+    # each personalization carries its own recipient, subject and text
+    mail = Mail(from_email=Email('emeldam@starinternational.co.zw'), plain_text_content='-body-')
+    for reply in replies:
+        personalization = Personalization()
+        personalization.add_to(To(reply['to_email']))
+        personalization.subject = reply['subject']
+        personalization.add_substitution(Substitution('-body-', reply['body']))
+        mail.add_personalization(personalization)
+    return sendgrid_client.send(mail)
+
+def update_message_state(updates):
+    with message_state_lock:
+        message_state.update(updates)
+        with open('message_state.json', 'w') as f:
+            json.dump(message_state, f, indent=4)
+
+# Follow-ups
+FOLLOW_UP_DELAY_MINUTES = float(os.getenv("FOLLOW_UP_DELAY_MINUTES", 24 * 60))
+FOLLOW_UP_CHANNELS = ('email', 'whatsapp')
+FOLLOW_UP_MESSAGE = "Hi, this is Tau from Star International following up on our last conversation. Do you have any loads you'd like us to transport for you?"
+
+def dispatch_follow_ups(batch):
+    failed = []
+    emails = []
+    for item in batch:
+        if item['channel'] == 'email':
+            emails.append(item)
+            continue
+        to = item['customer'] if item['customer'].startswith('whatsapp:') else f"whatsapp:{item['customer']}"
+        try:
+            whatsapp_client.messages.create(body=FOLLOW_UP_MESSAGE, from_=whatsapp_number, to=to)
+        except Exception as e:
+            app.logger.warning(f"Follow-up to {item['customer']} failed: {e}")
+            failed.append(item)
+
+    if emails:
+        try:
+            send_email_batch([{'to_email': item['customer'], 'subject': "Following up", 'body': FOLLOW_UP_MESSAGE} for item in emails])
+        except Exception as e:
+            app.logger.warning(f"Follow-up email batch of {len(emails)} failed: {e}")
+            failed.extend(emails)
+
+    update_message_state({item['customer']: 'follow_up_sent' for item in batch if item not in failed})
+    return failed
+
+follow_up_scheduler = FollowUpScheduler(
+    'follow_up_schedule.json',
+    dispatch_follow_ups,
+    batch_size=int(os.getenv("FOLLOW_UP_BATCH_SIZE", 50)),
+    rate=float(os.getenv("FOLLOW_UP_RATE_PER_SECOND", 5)),
+)
+
+def schedule_pending_follow_ups():
+    due_at = time.time() + FOLLOW_UP_DELAY_MINUTES * 60
+    with message_state_lock:
+        pending = [customer for customer, state in message_state.items() if state == 'follow_up_needed']
+    for customer in pending:
+        if not follow_up_scheduler.is_scheduled(customer):
+            follow_up_scheduler.schedule(customer, due_at, 'email' if '@' in customer else 'whatsapp')
+
+# Only one process should send follow-ups, so the scheduler is opt-in
+if os.getenv("FOLLOW_UP_SCHEDULER") == "1":
+    schedule_pending_follow_ups()
+    follow_up_scheduler.start()
+    atexit.register(follow_up_scheduler.stop)
+
+# Pitch library: one pitch per customer trade, generated off-peak
+PITCH_QUERY = "why should customers in the {trade} business work with Star International?"
+GENERIC_PITCH_QUERY = "why should customers work with Star International?"
+PITCH_OFF_PEAK_HOURS = os.getenv("PITCH_OFF_PEAK_HOURS", "1-5")
+PITCH_REFRESH_CHECK_SECONDS = 3600
+pitch_library = PitchLibrary('pitch_library.json')
+
+def current_pitch_version():
+    return library_version(knowledge_base.active.version, PITCH_QUERY, GPT_MODEL)
+
+def generate_trade_pitch(trade):
+    pitch = ask(PITCH_QUERY.format(trade=trade), channel='batch')
+    # Don't store a fallback answer as if it were a pitch
+    if pitch in (REFERRAL_MESSAGE, OVERLOAD_MESSAGE):
+        raise RuntimeError(f"No pitch generated for {trade}")
+    return pitch
+
+def refresh_pitch_library(force=False):
+    version = current_pitch_version()
+    if not force and pitch_library.is_current(version, customer_trades.values()):
+        return None
+    try:
+        result = pitch_library.build(version, customer_trades.values(), generate_trade_pitch, force=force)
+    except BuildInProgress:
+        app.logger.info("Pitch library build already running, skipping refresh")
+        return None
+    app.logger.info(f"Pitch library {result['version']} built: {result['pitches']} pitches, failed {result['failed']}, activated {result['activated']}")
+    return result
+
+def refresh_pitches_periodically():
+    while True:
+        if in_off_peak(PITCH_OFF_PEAK_HOURS):
+            try:
+                refresh_pitch_library()
+            except Exception as e:
+                app.logger.warning(f"Pitch library refresh failed: {e}")
+        time.sleep(PITCH_REFRESH_CHECK_SECONDS)
+
+if os.getenv("PITCH_REFRESH_SCHEDULER") == "1":
+    threading.Thread(target=refresh_pitches_periodically, daemon=True).start()
+
+# Conversation state, kept per sender (phone number or email address)
 MAX_INTERACTIONS = 15
-asked_about_loads = False
-asked_about_wellbeing = False
-asked_about_business = False
+conversations = {}
+conversations_lock = threading.Lock()
+
+def conversation_for(sender):
+    with conversations_lock:
+        state = conversations.get(sender)
+        if state is None:
+            state = conversations[sender] = {
+                'interaction_counter': 0,
+                'greeted': False,
+                'asked_about_business': False,
+                'asked_about_wellbeing': False,
+                'asked_about_loads': False,
+                'lock': threading.Lock(),
+            }
+        return state
+
+
+# On-demand profiling. With PROFILING=1 a webhook request is profiled when it
+# is picked by PROFILE_SAMPLE_RATE or carries an X-Profile header equal to
+# PROFILE_TOKEN. Without PROFILE_TOKEN only sampling works and the profiles
+# can't be listed or downloaded. With PROFILING unset no hooks are registered.
+# /process-emails is left out: its work runs on pool threads cProfile can't see.
+PROFILING = os.getenv("PROFILING") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILED_PATHS = {'/process_speech', '/process-whatsapp', '/process-email'}
+request_profiler = RequestProfiler(
+    'profiles',
+    max_files=int(os.getenv("PROFILE_MAX_FILES", 20)),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+)
+
+def profile_token_ok(value):
+    return PROFILE_TOKEN is not None and value == PROFILE_TOKEN
+
+if PROFILING:
+    @app.before_request
+    def start_request_profile():
+        if request.path in PROFILED_PATHS and (profile_token_ok(request.headers.get('X-Profile')) or request_profiler.sampled()):
+            g.profile = request_profiler.start()
+
+    @app.teardown_request
+    def finish_request_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            name = request_profiler.finish(profile, request.path)
+            app.logger.info(f"Profile written: {name}")
 
 
 @app.route('/', methods=['GET'])
@@ -166,18 +483,6 @@ def home():
     return "Welcome to Tau's IVR"
 
 def handle_conversation(speech_input, customer_status, response_type, phone_number):
-    global interaction_counter, greeted, asked_about_loads, asked_about_wellbeing, asked_about_business
-
-    # Variable Initialization
-    if 'asked_about_loads' not in globals():
-        asked_about_loads = False
-    if 'asked_about_wellbeing' not in globals():
-        asked_about_wellbeing = False
-    if 'greeted' not in globals():
-        greeted = False
-    if 'asked_about_business' not in globals():
-        asked_about_business = False
-
     if response_type == 'voice':
         response = VoiceResponse()
     elif response_type == 'email':
@@ -187,31 +492,31 @@ def handle_conversation(speech_input, customer_status, response_type, phone_numb
         message = response.message()
 
     def handle_new_customer_conversation():
-        global asked_about_business, asked_about_wellbeing, asked_about_loads
-        customer_trade = customer_trade.get(phone_number, "your industry")
+        customer_trade = customer_trades.get(phone_number, "your industry")
+        known_trade = customer_trades.get(phone_number)
 
-        if not greeted:
+        if not state['greeted']:
             greeting_message = "Hi, this is Tau from Star International. We are a transport and logistics company in Harare. How are you doing today?"
             if response_type == 'voice':
                 response.say(greeting_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['subject'] = "Welcome to Star International"
                 response['body'] = greeting_message
-            greeted = True
-            interaction_counter += 1
+            state['greeted'] = True
+            state['interaction_counter'] += 1
             return response
 
-        if not asked_about_business:
+        if not state['asked_about_business']:
             business_intro = f"I see you are in the {customer_trade} business. We at Star International understand how crucial reliable transport and logistics are for {customer_trade}. How is business going for you?"
             if response_type == 'voice':
                 response.say(business_intro, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['body'] = business_intro
-            asked_about_business = True
-            interaction_counter += 1
+            state['asked_about_business'] = True
+            state['interaction_counter'] += 1
             return response
 
-        if asked_about_business and not asked_about_wellbeing:
+        if state['asked_about_business'] and not state['asked_about_wellbeing']:
             sentiment = TextBlob(speech_input).sentiment.polarity
             if sentiment < -0.1:
                 follow_up_message = "I'm sorry to hear that you're facing challenges. If there's anything specific we can do to help, please let us know."
@@ -223,41 +528,43 @@ def handle_conversation(speech_input, customer_status, response_type, phone_numb
                 response.say(follow_up_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['body'] = follow_up_message
-            asked_about_wellbeing = True
-            interaction_counter += 1
+            state['asked_about_wellbeing'] = True
+            state['interaction_counter'] += 1
             return response
 
-        if asked_about_wellbeing and not asked_about_loads:
+        if state['asked_about_wellbeing'] and not state['asked_about_loads']:
             sentiment = TextBlob(speech_input).sentiment.polarity
             if sentiment > 0.1:
                 follow_up_message = "Fantastic! Let me share more about our services and how they can benefit your business."
-                query = "why should customers work with Star International?"
-                response_message = ask(query, df)
+                # Serve the precomputed pitch for their trade, generating live only if missing
+                response_message = pitch_library.get(known_trade) if known_trade else None
+                if response_message is None:
+                    query = PITCH_QUERY.format(trade=known_trade) if known_trade else GENERIC_PITCH_QUERY
+                    response_message = ask(query, channel=response_type)
             else:
                 follow_up_message = "I understand. When would be a convenient time for us to reach out again? We can discuss how our services can align with your needs."
+                response_message = ""
             if response_type == 'voice':
                 response.say(follow_up_message + " " + response_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['body'] = follow_up_message + " " + response_message
-            asked_about_loads = True
-            interaction_counter += 1
+            state['asked_about_loads'] = True
+            state['interaction_counter'] += 1
             return response
 
     def handle_existing_customer_conversation():
-        global asked_about_loads, asked_about_wellbeing
-        
-        if not greeted:
+        if not state['greeted']:
             greeting_message = "Hi, this is Tau from Star International. How are you?"
             if response_type == 'voice':
                 response.say(greeting_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['subject'] = "Checking In"
                 response['body'] = greeting_message
-            greeted = True
-            interaction_counter += 1
+            state['greeted'] = True
+            state['interaction_counter'] += 1
             return response
 
-        if not asked_about_wellbeing:
+        if not state['asked_about_wellbeing']:
             sentiment = TextBlob(speech_input).sentiment.polarity
             if sentiment < -0.1:
                 follow_up_message = "I'm sorry to hear that you're not feeling well. What's wrong?"
@@ -269,28 +576,28 @@ def handle_conversation(speech_input, customer_status, response_type, phone_numb
                 response.say(follow_up_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['body'] = follow_up_message
-            asked_about_wellbeing = True
-            interaction_counter += 1
+            state['asked_about_wellbeing'] = True
+            state['interaction_counter'] += 1
             return response
 
-        if asked_about_wellbeing and not asked_about_loads:
+        if state['asked_about_wellbeing'] and not state['asked_about_loads']:
             sentiment = TextBlob(speech_input).sentiment.polarity
             if sentiment > 0.1:
                 follow_up_message = "Great! Could you please provide more information about the load?"
-                asked_about_loads = True
+                state['asked_about_loads'] = True
             elif sentiment < -0.1:
                 follow_up_message = "I understand. Please let me know when you have any loads you need transported. If there's anything else I can assist with, please let me know. You can call, text or email. In the meantime, you can also check out our website https://www.starinternational.co.zw to see what we are up to."
-                interaction_counter = 0
-                greeted = False
-                asked_about_loads = False
-                asked_about_wellbeing = False
+                state['interaction_counter'] = 0
+                state['greeted'] = False
+                state['asked_about_loads'] = False
+                state['asked_about_wellbeing'] = False
             else:
                 follow_up_message = "I'm sorry, I didn't quite catch that. would you mind repeating?"
             if response_type == 'voice':
                 response.say(follow_up_message, voice='Polly.Gregory-Neural')
             elif response_type == 'email':
                 response['body'] = follow_up_message
-            interaction_counter += 1
+            state['interaction_counter'] += 1
             return response
         
     if customer_status == "unknown":
@@ -302,11 +609,14 @@ def handle_conversation(speech_input, customer_status, response_type, phone_numb
             response['body'] = "Email address not found in customers list."
         return response
 
-    if customer_status == "new":
-        return handle_new_customer_conversation()
+    # Turns for one sender run in order; different senders run in parallel
+    state = conversation_for(phone_number)
+    with state['lock']:
+        if customer_status == "new":
+            return handle_new_customer_conversation()
 
-    if customer_status == "existing":
-        return handle_existing_customer_conversation()
+        if customer_status == "existing":
+            return handle_existing_customer_conversation()
 
     return response
 
@@ -339,7 +649,7 @@ def ivr():
     gather = response.gather(
         input='speech',
         timeout=3,
-        action='/process_speech',
+        action='/process_speech?seq=1',
         method='POST'
     )
     gather.say('Tau from Star International, how can I assist you today?', voice='Polly.Gregory-Neural')
@@ -364,9 +674,36 @@ def process_speech():
         response.hangup()
         return str(response)
 
-    app.logger.info(f"Incoming speech input: {speech_input}")
+    sequence = request.args.get('seq', 0, type=int)
+    return idempotent(
+        webhook_idempotency_key('voice'),
+        lambda: process_speech_turn(speech_input, customer_status, phone_number, sequence),
+        lambda: overloaded_speech_turn(sequence),
+    )
+
+def process_speech_turn(speech_input, customer_status, phone_number, sequence):
+    if not admission.allow_sender(phone_number):
+        return overloaded_speech_turn(sequence)
 
+    app.logger.info(f"Incoming speech input: {speech_input}")
     response = handle_conversation(speech_input, customer_status, response_type='voice', phone_number=phone_number)
+    if response is None:
+        response = VoiceResponse()
+    return listen_for_next_turn(response, sequence)
+
+def overloaded_speech_turn(sequence):
+    response = VoiceResponse()
+    response.say(OVERLOAD_MESSAGE, voice='Polly.Gregory-Neural')
+    return listen_for_next_turn(response, sequence)
+
+def listen_for_next_turn(response, sequence):
+    # Listen for the next turn, numbered so Twilio retries of it can be replayed
+    response.gather(
+        input='speech',
+        timeout=3,
+        action=f'/process_speech?seq={sequence + 1}',
+        method='POST'
+    )
     return str(response)
 
 
@@ -406,13 +743,28 @@ def process_whatsapp():
     if not incoming_msg or not from_number:
         return '', 400
 
+    return idempotent(
+        webhook_idempotency_key('whatsapp'),
+        lambda: process_whatsapp_message(incoming_msg, from_number),
+        overloaded_whatsapp_message,
+    ), 200
+
+def overloaded_whatsapp_message():
+    response = MessagingResponse()
+    response.message(OVERLOAD_MESSAGE)
+    return str(response)
+
+def process_whatsapp_message(incoming_msg, from_number):
+    if not admission.allow_sender(from_number):
+        return overloaded_whatsapp_message()
+
     # Determine customer status
     customer_status = get_customer_status(from_number)
 
     # Process conversation based on customer status
     response = handle_conversation(incoming_msg, customer_status, response_type='whatsapp', phone_number=from_number)
     
-    return str(response), 200
+    return str(response)
 
 @app.route('/send-email', methods=['POST'])
 def send_email_route():
@@ -440,24 +792,222 @@ def send_email_route():
 
 @app.route('/process-email', methods=['POST'])
 def process_email():
-    email_content = request.json.get('email_content', '')
-    customer_email = request.json.get('from_email', '')
+    result = process_inbound_email(request.get_json(silent=True) or {})
+    if result['status'] == 'not_found':
+        return jsonify({'error': result['error']}), 404
+    if result['status'] == 'rate_limited':
+        return jsonify({"message": OVERLOAD_MESSAGE}), 429
+    if result['status'] != 'processed':
+        return jsonify({"message": "Failed to process email response"}), 500
+
+    try:
+        send_email(result['from_email'], result['subject'], result['body'])
+        return jsonify({"message": "Response email sent successfully"}), 200
+    except Exception as e:
+        return jsonify({"message": "Failed to send email"}), 500
+
+def read_inbound_emails():
+    # Yields (index, email, error) for each email in the upload. NDJSON is
+    # read line by line so processing starts before the upload ends, and a
+    # malformed line only fails that line.
+    if request.mimetype == 'application/x-ndjson':
+        lines = (line for line in request.stream if line.strip())
+        for index, line in enumerate(lines):
+            try:
+                email = json.loads(line)
+            except ValueError as e:
+                yield index, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(email, dict):
+                yield index, None, 'Expected a JSON object'
+                continue
+            yield index, email, None
+        return
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('emails')
+    if not isinstance(data, list):
+        yield None, None, 'Expected NDJSON or a JSON list of emails'
+        return
+    for index, email in enumerate(data):
+        if isinstance(email, dict):
+            yield index, email, None
+        else:
+            yield index, None, 'Expected a JSON object'
+
+def process_inbound_email(email, rate_limit=True):
+    # Shared by /process-email and /process-emails. The bulk endpoint has
+    # already waited for the sender's token, so it passes rate_limit=False.
+    email_content = email.get('email_content', '')
+    customer_email = email.get('from_email', '')
     customer_status = get_customer_status(customer_email)
 
     if customer_email not in customers['existing_customers'] and customer_email not in customers['new_customers']:
-        return jsonify({'error': 'Email address not found in customers.json'}), 404
+        return {'from_email': customer_email, 'status': 'not_found', 'error': 'Email address not found in customers.json'}
+
+    if rate_limit and not admission.allow_sender(customer_email):
+        return {'from_email': customer_email, 'status': 'rate_limited', 'message': OVERLOAD_MESSAGE}
 
     app.logger.info(f"Incoming email content: {email_content}")
 
     response = handle_conversation(email_content, customer_status, response_type='email', phone_number=customer_email)
-    if 'subject' in response and 'body' in response:
-        try:
-            send_email(customer_email, response['subject'], response['body'])
-            return jsonify({"message": "Response email sent successfully"}), 200
-        except Exception as e:
-            return jsonify({"message": "Failed to send email"}), 500
-    else:
-        return jsonify({"message": "Failed to process email response"}), 500
+    if response and 'subject' in response and 'body' in response:
+        return {'from_email': customer_email, 'status': 'processed', 'subject': response['subject'], 'body': response['body']}
+    return {'from_email': customer_email, 'status': 'error', 'error': 'Failed to process email response'}
+
+@app.route('/process-emails', methods=['POST'])
+def process_emails():
+    emails = read_inbound_emails()
+
+    def generate():
+        outbox = []
+
+        def flush():
+            batch = outbox[:]
+            outbox.clear()
+            try:
+                response = send_email_batch(batch)
+                return {'batch_sent': len(batch), 'status_code': response.status_code}
+            except Exception as e:
+                return {'batch_sent': 0, 'batch_failed': len(batch), 'error': str(e)}
+
+        def finished(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'status': 'error', 'error': str(e)}
+            result = {'index': pending.pop(future), **result}
+            if result.get('status') == 'processed':
+                outbox.append({'to_email': result['from_email'], 'subject': result['subject'], 'body': result['body']})
+            lines = [json.dumps(result) + '\n']
+            if len(outbox) >= EMAIL_SEND_BATCH_SIZE:
+                lines.append(json.dumps(flush()) + '\n')
+            return lines
+
+        # Keep a bounded number of emails in flight and stream each result
+        # as soon as it is ready, tagged with its position in the upload.
+        # An email whose sender is over the rate limit waits in `delayed`
+        # until the sender's token is due, without holding a worker.
+        with ThreadPoolExecutor(max_workers=BULK_EMAIL_WORKERS) as pool:
+            pending = {}
+            delayed = []
+            max_pending = BULK_EMAIL_WORKERS * 2
+
+            def advance(block):
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now and len(pending) < max_pending:
+                    _, index, email = heapq.heappop(delayed)
+                    pending[pool.submit(process_inbound_email, email, rate_limit=False)] = index
+                if not block:
+                    done = [future for future in pending if future.done()]
+                elif len(pending) >= max_pending or not delayed:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                elif pending:
+                    done, _ = wait(pending, timeout=max(0.0, delayed[0][0] - time.monotonic()), return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(max(0.0, delayed[0][0] - time.monotonic()))
+                    done = []
+                for future in done:
+                    yield from finished(future)
+
+            for index, email, error in emails:
+                if error is not None:
+                    yield json.dumps({'index': index, 'status': 'error', 'error': error}) + '\n'
+                    continue
+                due = time.monotonic() + admission.reserve_sender(email.get('from_email', ''))
+                heapq.heappush(delayed, (due, index, email))
+                yield from advance(block=False)
+                while len(pending) >= max_pending or len(delayed) >= BULK_EMAIL_MAX_DELAYED:
+                    yield from advance(block=True)
+            while pending or delayed:
+                yield from advance(block=True)
+
+        if outbox:
+            yield json.dumps(flush()) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def parse_minutes(value):
+    # None unless value is a finite, non-negative number; NaN would never
+    # fire and breaks the scheduler's heap ordering
+    try:
+        minutes = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(minutes) or minutes < 0:
+        return None
+    return minutes
+
+@app.route('/follow-ups', methods=['POST'])
+def schedule_follow_up():
+    # Entries only persist and fire in the process running the scheduler
+    if not follow_up_scheduler.running:
+        return jsonify({'error': 'Follow-up scheduler is not running in this process'}), 503
+
+    data = request.get_json(silent=True) or {}
+    customer = data.get('customer')
+
+    if not customer:
+        return jsonify({'error': 'Missing "customer" in request'}), 400
+
+    delay_minutes = parse_minutes(data.get('due_in_minutes', FOLLOW_UP_DELAY_MINUTES))
+    if delay_minutes is None:
+        return jsonify({'error': '"due_in_minutes" must be a non-negative number'}), 400
+
+    channel = data.get('channel', 'email' if '@' in customer else 'whatsapp')
+    if channel not in FOLLOW_UP_CHANNELS:
+        return jsonify({'error': f'"channel" must be one of {", ".join(FOLLOW_UP_CHANNELS)}'}), 400
+
+    follow_up_scheduler.schedule(customer, time.time() + delay_minutes * 60, channel)
+    update_message_state({customer: 'follow_up_needed'})
+    return jsonify({'message': 'Follow-up scheduled', 'customer': customer, 'channel': channel}), 200
+
+@app.route('/follow-ups/upcoming', methods=['GET'])
+def upcoming_follow_ups():
+    # Dry run: what would fire in the next N minutes, without sending it
+    minutes = parse_minutes(request.args.get('minutes', 60))
+    if minutes is None:
+        return jsonify({'error': '"minutes" must be a non-negative number'}), 400
+    follow_ups = follow_up_scheduler.upcoming(minutes)
+    return jsonify({'minutes': minutes, 'count': len(follow_ups), 'follow_ups': follow_ups, 'stats': follow_up_scheduler.stats()}), 200
+
+@app.route('/pitches', methods=['GET'])
+def pitches():
+    return jsonify({**pitch_library.summary(), 'current': current_pitch_version()}), 200
+
+@app.route('/pitches/refresh', methods=['POST'])
+def refresh_pitches():
+    force = bool((request.get_json(silent=True) or {}).get('force'))
+    if pitch_library.building:
+        return jsonify({'error': 'A pitch library build is already running'}), 409
+    threading.Thread(target=refresh_pitch_library, kwargs={'force': force}, daemon=True).start()
+    return jsonify({'message': 'Pitch library refresh started'}), 202
+
+@app.route('/knowledge-base', methods=['GET'])
+def knowledge_base_status():
+    return jsonify(knowledge_base.status()), 200
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    if not PROFILING or not profile_token_ok(request.headers.get('X-Profile-Token')):
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    return jsonify({'profiles': request_profiler.list()}), 200
+
+@app.route('/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    if not PROFILING or not profile_token_ok(request.headers.get('X-Profile-Token')):
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    path = request_profiler.path_for(name)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    # ?format=text returns the top functions by cumulative time
+    if request.args.get('format') == 'text':
+        return Response(request_profiler.summary(name), mimetype='text/plain')
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+@app.route('/admission-stats', methods=['GET'])
+def admission_stats():
+    return jsonify({**admission.stats(), 'openai_breaker': openai_breaker.state, 'idempotency': webhook_responses.stats()}), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+from unittest.mock import Mock
+
+from textblob import TextBlob
+
+import twilio.rest
+from mock_twilio import mock_twilio_client
+
+# Throughput of /process-email one message at a time against the bulk
+# /process-emails endpoint, with a stub LLM and a fake mail transport.
+#
+#     python bench_bulk_email.py [emails]
+LLM_LATENCY = 0.8
+SEND_LATENCY = 0.3
+
+# No real Twilio calls or per-sender limits while benchmarking
+twilio.rest.Client = lambda *args, **kwargs: mock_twilio_client
+os.environ.setdefault("SENDER_BURST", "1000000")
+os.environ.setdefault("ASK_MAX_CONCURRENT", "64")
+
+import app
+
+
+class FakeMailTransport:
+    def __init__(self):
+        self.requests = 0
+
+    def send(self, mail):
+        time.sleep(SEND_LATENCY)
+        self.requests += 1
+        return Mock(status_code=202)
+
+
+# A real handle_conversation stops answering a sender after a few turns. The
+# stub runs one LLM-backed turn per email under the sender's conversation
+# lock, like the real one: sentiment on the input and then a slow ask().
+def stub_handle_conversation(speech_input, customer_status, response_type, phone_number):
+    with app.conversation_for(phone_number)['lock']:
+        TextBlob(speech_input).sentiment.polarity
+        time.sleep(LLM_LATENCY)
+    return {'subject': "Star International", 'body': "Star International moves your loads safely and on time."}
+
+
+def fake_send_email(to_email, subject, content):
+    return transport.send(Mock(personalizations=[to_email]))
+
+
+transport = FakeMailTransport()
+app.handle_conversation = stub_handle_conversation
+app.send_email = fake_send_email
+app.sendgrid_client = transport
+
+
+def make_emails(count):
+    senders = app.customers['existing_customers'] + app.customers['new_customers']
+    return [
+        {'from_email': senders[i % len(senders)], 'email_content': "Great, tell me more about your trucks."}
+        for i in range(count)
+    ]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    emails = make_emails(count)
+    test_client = app.app.test_client()
+
+    start = time.perf_counter()
+    for email in emails:
+        test_client.post('/process-email', json=email)
+    sequential = time.perf_counter() - start
+    sequential_requests = transport.requests
+
+    transport.requests = 0
+    start = time.perf_counter()
+    body = '\n'.join(json.dumps(email) for email in emails)
+    response = test_client.post('/process-emails', data=body, content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    bulk = time.perf_counter() - start
+
+    print(f"{count} emails, LLM {LLM_LATENCY}s, send {SEND_LATENCY}s")
+    print(f"  /process-email:  {sequential:.2f}s, {count / sequential:.1f} emails/s, {sequential_requests} send requests")
+    print(f"  /process-emails: {bulk:.2f}s, {count / bulk:.1f} emails/s, {transport.requests} send requests, {len(lines)} result lines")
@@ -0,0 +1,48 @@
+import sys
+import time
+
+import app
+from app import ask, query_message, knowledge_base, GPT_MODEL, num_tokens
+
+# Fixed question set used to compare prompts with and without context packing.
+# Pass relatedness cutoffs to compare them, e.g.
+#
+#     python bench_context_packing.py 0.2 0.3 0.4
+QUESTIONS = [
+    "why should customers work with Star International?",
+    "What transport services does Star International offer?",
+    "Do you move freight across borders?",
+    "How can I get a quote for moving a load to Beitbridge?",
+    "Where is Star International based?",
+    "What kind of trucks do you have?",
+]
+
+TOKEN_BUDGET = 4096 - 500
+
+
+def measure(question, pack_context):
+    df = knowledge_base.active.data
+    message = query_message(question, df, model=GPT_MODEL, token_budget=TOKEN_BUDGET, pack_context=pack_context)
+    start = time.perf_counter()
+    ask(question, df, token_budget=TOKEN_BUDGET, pack_context=pack_context)
+    return num_tokens(message), time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    cutoffs = [float(c) for c in sys.argv[1:]] or [app.CONTEXT_MIN_RELATEDNESS]
+    baselines = {question: measure(question, pack_context=False) for question in QUESTIONS}
+    for cutoff in cutoffs:
+        app.CONTEXT_MIN_RELATEDNESS = cutoff
+        total_saved = 0
+        total_latency_change = 0.0
+        print(f"min relatedness {cutoff}")
+        for question in QUESTIONS:
+            baseline_tokens, baseline_latency = baselines[question]
+            packed_tokens, packed_latency = measure(question, pack_context=True)
+            total_saved += baseline_tokens - packed_tokens
+            total_latency_change += packed_latency - baseline_latency
+            print(f"  {question}")
+            print(f"    prompt tokens: {baseline_tokens} -> {packed_tokens} (saved {baseline_tokens - packed_tokens})")
+            print(f"    ask latency:   {baseline_latency:.2f}s -> {packed_latency:.2f}s")
+        print(f"  Prompt tokens saved: {total_saved} total, {total_saved / len(QUESTIONS):.0f} per question")
+        print(f"  Latency change: {total_latency_change / len(QUESTIONS):+.2f}s per question")
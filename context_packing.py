@@ -0,0 +1,52 @@
+import numpy as np
+
+# Defaults for packing the retrieved chunks into the prompt
+MMR_LAMBDA = 0.7
+MIN_RELATEDNESS = 0.3
+DUPLICATE_THRESHOLD = 0.95
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(
+    query_embedding,
+    candidate_embeddings,
+    lambda_mult: float = MMR_LAMBDA,
+    min_relatedness: float = MIN_RELATEDNESS,
+    duplicate_threshold: float = DUPLICATE_THRESHOLD,
+    limit: int = None,
+) -> list[int]:
+    # Maximal marginal relevance: each pick balances relatedness to the query
+    # against similarity to the chunks already picked. Candidates below
+    # min_relatedness are never picked, except the most related one so the
+    # prompt always has some context, and anything at or above
+    # duplicate_threshold to a picked chunk is dropped as a near-duplicate.
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if candidates.size == 0:
+        return []
+    candidates = normalize_rows(candidates)
+    query = normalize_rows(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+
+    relatedness = candidates @ query
+    remaining = relatedness >= min_relatedness
+    remaining[int(np.argmax(relatedness))] = True
+    max_similarity = np.zeros(len(candidates), dtype=np.float32)
+    limit = len(candidates) if limit is None else limit
+
+    selected = []
+    while len(selected) < limit and remaining.any():
+        scores = lambda_mult * relatedness - (1 - lambda_mult) * max_similarity
+        scores[~remaining] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        remaining[best] = False
+
+        similarity = candidates @ candidates[best]
+        remaining &= similarity < duplicate_threshold
+        np.maximum(max_similarity, similarity, out=max_similarity)
+
+    return selected
@@ -0,0 +1,184 @@
+import os
+import ast
+import time
+import hashlib
+import atexit
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory, resource_tracker
+
+# Shared memory layout: a header of int64 fields (magic, ready flag, rows,
+# dims, text bytes, creator pid), the text offsets, the normalized float32
+# embedding matrix and then the UTF-8 encoded texts.
+HEADER_FIELDS = 8
+HEADER_BYTES = HEADER_FIELDS * 8
+MAGIC = 0x7461755f656d62  # "tau_emb"
+READY_TIMEOUT = 120.0
+
+
+def dataset_version(path: str) -> str:
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def read_embeddings_csv(path: str) -> tuple[list[str], np.ndarray]:
+    df = pd.read_csv(path)
+    matrix = np.array([ast.literal_eval(e) for e in df['embedding']], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return df['text'].tolist(), matrix / norms
+
+
+class EmbeddingStore:
+    # Read-only embedding matrix and texts. The arrays may be views into a
+    # shared memory segment, in which case every worker attached to the same
+    # dataset version reads the same pages.
+    def __init__(self, matrix: np.ndarray, offsets: np.ndarray, text_bytes, version: str, shm=None):
+        self.matrix = matrix
+        self.offsets = offsets
+        self.text_bytes = text_bytes
+        self.version = version
+        self.shm = shm
+        self.owner_pid = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.offsets.nbytes + len(self.text_bytes)
+
+    def release(self):
+        # Only the creating process unlinks the segment, and only once.
+        # Attached workers keep their mapping until they drop the store.
+        if self.shm is None or self.owner_pid != os.getpid():
+            return
+        self.owner_pid = None
+        try:
+            # unlink() unregisters the name, so hand it back to the tracker first
+            resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def from_csv(cls, path: str) -> "EmbeddingStore":
+        texts, matrix = read_embeddings_csv(path)
+        offsets, text_bytes = _encode_texts(texts)
+        return cls(matrix, offsets, text_bytes, dataset_version(path))
+
+    @classmethod
+    def shared(cls, path: str) -> "EmbeddingStore":
+        # The first process to get here (the master when preloading) parses
+        # the CSV into a new segment; everyone else attaches to it by name.
+        version = dataset_version(path)
+        name = f"tau_embeddings_{version}"
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            try:
+                return cls._create_shared(path, name, version)
+            except FileExistsError:
+                shm = shared_memory.SharedMemory(name=name)
+        try:
+            return cls._attach_shared(shm, version)
+        except TimeoutError:
+            # The creator died before marking the segment ready. Unlink the
+            # stale segment and build a fresh one under the same name.
+            resource_tracker.register(shm._name, 'shared_memory')
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            return cls._create_shared(path, name, version)
+        except FileExistsError:
+            return cls._attach_shared(shared_memory.SharedMemory(name=name), version)
+
+    @classmethod
+    def _create_shared(cls, path: str, name: str, version: str) -> "EmbeddingStore":
+        texts, matrix = read_embeddings_csv(path)
+        offsets, text_bytes = _encode_texts(texts)
+        rows, dims = matrix.shape
+        size = HEADER_BYTES + offsets.nbytes + matrix.nbytes + len(text_bytes)
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        # Lifetime is managed by _release rather than the resource tracker,
+        # which forked workers share with the creator
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[5] = os.getpid()
+        header[0] = MAGIC
+        header[2:5] = (rows, dims, len(text_bytes))
+
+        store = cls._views(shm, rows, dims, len(text_bytes), version)
+        store.offsets[:] = offsets
+        store.matrix[:] = matrix
+        shm.buf[size - len(text_bytes):size] = text_bytes
+        store.matrix.flags.writeable = False
+        store.offsets.flags.writeable = False
+        store.owner_pid = os.getpid()
+        atexit.register(store.release)
+        header[1] = 1
+        return store
+
+    @classmethod
+    def _attach_shared(cls, shm, version: str) -> "EmbeddingStore":
+        # Attaching processes must not unlink the segment when they exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        deadline = time.monotonic() + READY_TIMEOUT
+        while header[1] != 1:
+            if time.monotonic() > deadline or (header[5] and not _pid_alive(int(header[5]))):
+                raise TimeoutError(f"Shared embeddings {shm.name} were never marked ready")
+            time.sleep(0.05)
+        if header[0] != MAGIC:
+            raise ValueError(f"Shared memory segment {shm.name} does not hold embeddings")
+
+        store = cls._views(shm, int(header[2]), int(header[3]), int(header[4]), version)
+        store.matrix.flags.writeable = False
+        store.offsets.flags.writeable = False
+        return store
+
+    @classmethod
+    def _views(cls, shm, rows: int, dims: int, text_nbytes: int, version: str) -> "EmbeddingStore":
+        offsets_start = HEADER_BYTES
+        matrix_start = offsets_start + (rows + 1) * 8
+        text_start = matrix_start + rows * dims * 4
+        offsets = np.ndarray((rows + 1,), dtype=np.int64, buffer=shm.buf, offset=offsets_start)
+        matrix = np.ndarray((rows, dims), dtype=np.float32, buffer=shm.buf, offset=matrix_start)
+        text_bytes = shm.buf[text_start:text_start + text_nbytes]
+        return cls(matrix, offsets, text_bytes, version, shm)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def text(self, i: int) -> str:
+        return bytes(self.text_bytes[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def ranked(self, query_embedding, top_n: int = 100) -> tuple[list[str], list[float], list[np.ndarray]]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        relatednesses = self.matrix @ (query / norm if norm else query)
+        top_n = min(top_n, len(relatednesses))
+        if top_n == 0:
+            return [], [], []
+        top = np.argpartition(-relatednesses, top_n - 1)[:top_n]
+        top = top[np.argsort(-relatednesses[top])]
+        return [self.text(i) for i in top], relatednesses[top].tolist(), list(self.matrix[top])
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _encode_texts(texts: list[str]) -> tuple[np.ndarray, bytes]:
+    encoded = [t.encode('utf-8') for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import random
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI API, used to check the timeouts, hedging and
+# circuit breaker in app.py. Start it, then run the app with
+# OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+#
+# FAKE_OPENAI_DELAY         seconds to sleep before answering
+# FAKE_OPENAI_FAILURE_RATE  fraction of requests answered with a 500
+PORT = int(os.getenv("FAKE_OPENAI_PORT", 8001))
+DELAY = float(os.getenv("FAKE_OPENAI_DELAY", 0))
+FAILURE_RATE = float(os.getenv("FAKE_OPENAI_FAILURE_RATE", 0))
+EMBEDDING_DIMENSIONS = 1536
+
+
+def fake_embedding(text):
+    seed = int(hashlib.sha256(text.encode()).hexdigest(), 16)
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(DELAY)
+
+        if random.random() < FAILURE_RATE:
+            return self.send_json(500, {"error": {"message": "fake failure", "type": "server_error"}})
+
+        if self.path.endswith('/embeddings'):
+            inputs = body.get('input', '')
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            return self.send_json(200, {
+                "object": "list",
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text)} for i, text in enumerate(inputs)],
+                "model": body.get('model'),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        if self.path.endswith('/chat/completions'):
+            return self.send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get('model'),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Star International moves your loads safely and on time."},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    print(f"Fake OpenAI listening on http://127.0.0.1:{PORT}/v1 (delay={DELAY}s, failure_rate={FAILURE_RATE})")
+    ThreadingHTTPServer(('127.0.0.1', PORT), FakeOpenAIHandler).serve_forever()
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import heapq
+import itertools
+import threading
+
+
+class FollowUpScheduler:
+    # Due follow-ups live in a heap ordered by due time, with a dict holding
+    # the current entry per customer. Rescheduling or cancelling only updates
+    # the dict; stale heap entries are skipped when they reach the top, so
+    # every operation stays O(log n).
+    def __init__(
+        self,
+        path: str,
+        dispatch,
+        batch_size: int = 50,
+        rate: float = 5.0,
+        retry_delay: float = 300.0,
+        max_attempts: int = 3,
+        save_interval: float = 5.0,
+    ):
+        self.path = path
+        self.dispatch = dispatch
+        self.batch_size = batch_size
+        self.rate = rate
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._dirty = False
+        self._stopping = threading.Event()
+        self._threads = []
+        self._counts = {'dispatched': 0, 'failed': 0, 'dropped': 0}
+        self._load()
+
+    def schedule(self, customer: str, due_at: float, channel: str, attempts: int = 0):
+        with self._wakeup:
+            entry = {'due_at': due_at, 'channel': channel, 'attempts': attempts, 'seq': next(self._sequence)}
+            self._entries[customer] = entry
+            heapq.heappush(self._heap, (due_at, entry['seq'], customer))
+            self._dirty = True
+            # Rebuild once stale entries outnumber live ones
+            if len(self._heap) > 2 * len(self._entries) + 1024:
+                self._heap = [(e['due_at'], e['seq'], c) for c, e in self._entries.items()]
+                heapq.heapify(self._heap)
+            # Wake the worker in case this is now the earliest follow-up
+            self._wakeup.notify()
+
+    def cancel(self, customer: str) -> bool:
+        with self._lock:
+            if self._entries.pop(customer, None) is None:
+                return False
+            self._dirty = True
+            return True
+
+    def is_scheduled(self, customer: str) -> bool:
+        with self._lock:
+            return customer in self._entries
+
+    def upcoming(self, minutes: float, now: float = None) -> list[dict]:
+        # Dry run: walk only the part of the heap due within the window
+        horizon = (now or time.time()) + minutes * 60
+        due = []
+        with self._lock:
+            stack = [0] if self._heap else []
+            while stack:
+                i = stack.pop()
+                due_at, seq, customer = self._heap[i]
+                if due_at > horizon:
+                    continue
+                entry = self._entries.get(customer)
+                if entry is not None and entry['seq'] == seq:
+                    due.append({'customer': customer, 'due_at': due_at, 'channel': entry['channel'], 'attempts': entry['attempts']})
+                stack.extend(c for c in (2 * i + 1, 2 * i + 2) if c < len(self._heap))
+        due.sort(key=lambda d: d['due_at'])
+        return due
+
+    def pop_due(self, now: float = None) -> list[dict]:
+        now = now or time.time()
+        batch = []
+        with self._lock:
+            while self._heap and len(batch) < self.batch_size and self._heap[0][0] <= now:
+                due_at, seq, customer = heapq.heappop(self._heap)
+                entry = self._entries.get(customer)
+                if entry is None or entry['seq'] != seq:
+                    continue
+                del self._entries[customer]
+                batch.append({'customer': customer, 'due_at': due_at, 'channel': entry['channel'], 'attempts': entry['attempts']})
+            if batch:
+                self._dirty = True
+        return batch
+
+    def run_due(self, now: float = None) -> int:
+        batch = self.pop_due(now)
+        if not batch:
+            return 0
+        failed = self.dispatch(batch) or []
+        failed_customers = {item['customer'] for item in failed}
+        for item in batch:
+            if item['customer'] not in failed_customers:
+                self._counts['dispatched'] += 1
+            elif item['attempts'] + 1 < self.max_attempts:
+                self._counts['failed'] += 1
+                self.schedule(item['customer'], time.time() + self.retry_delay, item['channel'], item['attempts'] + 1)
+            else:
+                self._counts['dropped'] += 1
+        return len(batch)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and not self._stopping.is_set()
+
+    def start(self):
+        for target in (self._run, self._save_periodically):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.save()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            sent = self.run_due()
+            if sent:
+                # Rate limit the outbound channels between batches
+                self._stopping.wait(sent / self.rate)
+                continue
+            with self._wakeup:
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._wakeup.wait(timeout)
+
+    def _save_periodically(self):
+        while not self._stopping.wait(self.save_interval):
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                customer: {'due_at': e['due_at'], 'channel': e['channel'], 'attempts': e['attempts']}
+                for customer, e in self._entries.items()
+            }
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(snapshot))
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        for customer, e in snapshot.items():
+            seq = next(self._sequence)
+            self._entries[customer] = {'due_at': e['due_at'], 'channel': e['channel'], 'attempts': e.get('attempts', 0), 'seq': seq}
+            self._heap.append((e['due_at'], seq, customer))
+        heapq.heapify(self._heap)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, 'pending': len(self._entries), 'heap_size': len(self._heap)}
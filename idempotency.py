@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    def __init__(self, expires: float):
+        self.expires = expires
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IdempotencyCache:
+    # Remembers the response for a webhook key for `ttl` seconds. A duplicate
+    # that arrives while the first request is still running waits for it, up
+    # to `timeout` seconds, and gets the same response instead of running the
+    # handler again.
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = {'computed': 0, 'replayed': 0, 'waited': 0, 'timed_out': 0}
+
+    def get_or_compute(self, key: str, compute, timeout: float = None):
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(time.monotonic() + self.ttl)
+                owner = True
+                self._counts['computed'] += 1
+            else:
+                owner = False
+                self._counts['replayed' if entry.done.is_set() else 'waited'] += 1
+
+        if owner:
+            try:
+                entry.result = compute()
+            except BaseException as e:
+                # Forget failures so the next retry runs the handler again
+                entry.error = e
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                raise
+            finally:
+                entry.done.set()
+            return entry.result
+
+        if not entry.done.wait(self.ttl if timeout is None else timeout):
+            with self._lock:
+                self._counts['timed_out'] += 1
+            raise TimeoutError(f"Request {key} is still being processed")
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now and len(self._entries) < self.max_entries:
+                break
+            # Never evict a computation that duplicates may be waiting on
+            if not entry.done.is_set():
+                break
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, 'entries': len(self._entries)}
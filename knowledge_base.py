@@ -0,0 +1,83 @@
+import time
+import threading
+
+from embedding_store import dataset_version
+
+
+class KnowledgeBase:
+    def __init__(self, data, version: str, loaded_at: float, load_seconds: float):
+        self.data = data
+        self.version = version
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+
+
+class KnowledgeBaseManager:
+    # Holds the active knowledge base and swaps in new versions of the
+    # dataset. Loading, including any derived matrices, happens on the
+    # watcher thread; the swap is a single reference assignment, so a request
+    # that already grabbed `active` finishes on the old version while new
+    # requests see the new one.
+    def __init__(self, path: str, loader, poll_interval: float = 30.0):
+        self.path = path
+        self.loader = loader
+        self.poll_interval = poll_interval
+        self._reload_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.last_error = None
+        self.active = None
+        self.reload()
+
+    def reload(self) -> bool:
+        with self._reload_lock:
+            version = dataset_version(self.path)
+            if self.active is not None and self.active.version == version:
+                return False
+            started = time.perf_counter()
+            data = self.loader(self.path)
+            loaded = KnowledgeBase(data, version, time.time(), time.perf_counter() - started)
+            previous, self.active = self.active, loaded
+            self.last_error = None
+        # Old shared segments are unlinked by name only; requests still
+        # holding the old version keep reading their mapping
+        if previous is not None and hasattr(previous.data, 'release'):
+            previous.data.release()
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        # The watcher thread doesn't survive fork, and if it was mid-reload
+        # the child inherits a lock nobody will release
+        self._reload_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the current version, e.g. while the file is
+                # still being written, and try again on the next poll
+                self.last_error = repr(e)
+
+    def status(self) -> dict:
+        active = self.active
+        return {
+            'version': active.version,
+            'loaded_at': active.loaded_at,
+            'load_seconds': active.load_seconds,
+            'rows': len(active.data),
+            'memory_bytes': getattr(active.data, 'nbytes', None),
+            'shared_memory': getattr(active.data, 'shm', None) is not None,
+            'last_error': self.last_error,
+        }
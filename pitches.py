@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def library_version(*parts) -> str:
+    # Changes whenever the dataset or anything that shapes the prompt does
+    return hashlib.sha1("\0".join(str(p) for p in parts).encode()).hexdigest()[:12]
+
+
+class BuildInProgress(Exception):
+    pass
+
+
+class PitchLibrary:
+    # Per-trade pitches generated ahead of time and stored on disk. The file
+    # keeps the last few versions so a bad batch can be inspected or rolled
+    # back; lookups always read the active one. Other workers pick up a
+    # rebuild because the file is re-read whenever its mtime changes.
+    def __init__(self, path: str, keep_versions: int = 3):
+        self.path = path
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._library = {'active': None, 'versions': {}}
+        self._mtime = None
+        with self._lock:
+            self._refresh_from_disk()
+
+    def _refresh_from_disk(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            self._library = json.load(f)
+        self._mtime = mtime
+
+    def _active(self) -> dict:
+        self._refresh_from_disk()
+        return self._library['versions'].get(self._library['active'])
+
+    @property
+    def active_version(self):
+        with self._lock:
+            self._refresh_from_disk()
+            return self._library['active']
+
+    def get(self, trade: str):
+        with self._lock:
+            active = self._active()
+            if active is None:
+                return None
+            return active['pitches'].get(trade)
+
+    def is_current(self, version: str, trades) -> bool:
+        # Current means the active version matches and every trade has a pitch
+        with self._lock:
+            active = self._active()
+            return self._library['active'] == version and set(trades) <= set(active['pitches'])
+
+    @property
+    def building(self) -> bool:
+        return self._build_lock.locked()
+
+    def build(self, version: str, trades, generate, workers: int = 4, force: bool = False) -> dict:
+        # Generate one pitch per distinct trade concurrently. When rebuilding
+        # the active version only missing trades are generated unless forced.
+        # A build with failures only becomes active if it has some pitches and
+        # at least as many as the current one; either way the failed trades
+        # are retried on the next run. Only one build runs at a time.
+        if not self._build_lock.acquire(blocking=False):
+            raise BuildInProgress("A pitch library build is already running")
+        try:
+            return self._build(version, trades, generate, workers, force)
+        finally:
+            self._build_lock.release()
+
+    def _build(self, version: str, trades, generate, workers: int, force: bool) -> dict:
+        trades = sorted(set(trades))
+        started = time.time()
+        with self._lock:
+            active = self._active()
+            current_version = self._library['active']
+        existing = dict(active['pitches']) if active is not None and current_version == version and not force else {}
+        active_count = len(active['pitches']) if active is not None else 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {trade: pool.submit(generate, trade) for trade in trades if trade not in existing}
+        pitches = {trade: pitch for trade, pitch in existing.items() if trade in trades}
+        failed = []
+        for trade, future in futures.items():
+            try:
+                pitches[trade] = future.result()
+            except Exception:
+                failed.append(trade)
+
+        activated = not failed or (bool(pitches) and len(pitches) >= active_count)
+        if activated:
+            with self._lock:
+                self._refresh_from_disk()
+                self._library['versions'][version] = {
+                    'created_at': started,
+                    'build_seconds': time.time() - started,
+                    'pitches': pitches,
+                    'failed': failed,
+                }
+                self._library['active'] = version
+                for old in sorted(self._library['versions'], key=lambda v: self._library['versions'][v]['created_at'])[:-self.keep_versions]:
+                    del self._library['versions'][old]
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._library, f, indent=4)
+                os.replace(tmp_path, self.path)
+                self._mtime = os.stat(self.path).st_mtime_ns
+        return {'version': version, 'pitches': len(pitches), 'failed': failed, 'activated': activated}
+
+    def summary(self) -> dict:
+        with self._lock:
+            active = self._active() or {}
+            return {
+                'active': self._library['active'],
+                'created_at': active.get('created_at'),
+                'trades': sorted(active.get('pitches', {})),
+                'failed': active.get('failed', []),
+                'versions': sorted(self._library['versions']),
+            }
+
+
+def in_off_peak(hours: str, hour: int = None) -> bool:
+    # hours is "start-end" in local time, e.g. "1-5" or "22-4"
+    start, end = (int(h) for h in hours.split('-'))
+    hour = time.localtime().tm_hour if hour is None else hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
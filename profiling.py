@@ -0,0 +1,76 @@
+import os
+import re
+import io
+import time
+import random
+import pstats
+import cProfile
+import threading
+
+
+class RequestProfiler:
+    # Deterministic (cProfile) profiles of single requests, written to a
+    # bounded ring of .prof files. Only one request is profiled at a time:
+    # recent Pythons allow a single active profiler per process, and it keeps
+    # the overhead on a busy worker to one request.
+    def __init__(self, directory: str, max_files: int = 20, sample_rate: float = 0.0):
+        self.directory = directory
+        self.max_files = max_files
+        self.sample_rate = sample_rate
+        self._busy = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._busy.release()
+            return None
+        return profile, time.perf_counter()
+
+    def finish(self, handle, label: str) -> str:
+        profile, started = handle
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        now = time.time()
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}-{re.sub(r'[^A-Za-z0-9_-]+', '_', label).strip('_')}-{elapsed_ms:.0f}ms.prof"
+
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(os.path.join(self.directory, name))
+            for old in self.list()[self.max_files:]:
+                os.remove(os.path.join(self.directory, old['name']))
+        return name
+
+    def list(self) -> list[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.prof'):
+                stat = os.stat(os.path.join(self.directory, name))
+                profiles.append({'name': name, 'size': stat.st_size, 'created_at': stat.st_mtime})
+        profiles.sort(key=lambda p: p['created_at'], reverse=True)
+        return profiles
+
+    def path_for(self, name: str):
+        # Only serve files that are currently in the ring
+        if name not in {p['name'] for p in self.list()}:
+            return None
+        return os.path.join(self.directory, name)
+
+    def summary(self, name: str, limit: int = 40) -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(self.path_for(name), stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,71 @@
+import ast
+import sys
+import multiprocessing as mp
+
+import pandas as pd
+
+from embedding_store import EmbeddingStore
+
+# Compares per-worker memory for the two ways of loading the embeddings:
+# every worker parsing its own DataFrame, and workers attached to the shared
+# memory segment created by a preloading master.
+#
+#     python report_worker_rss.py [workers] [embeddings csv]
+EMBEDDINGS_PATH = "DATASET/emdeddings_dataset.csv"
+
+
+def memory_kb():
+    usage = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                usage['rss'] = int(line.split()[1])
+    # PSS splits shared pages between the processes mapping them
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                usage['pss'] = int(line.split()[1])
+    return usage
+
+
+def worker(mode, path, barrier, results):
+    if mode == 'dataframe':
+        df = pd.read_csv(path)
+        df['embedding'] = df['embedding'].apply(ast.literal_eval)
+    else:
+        df = EmbeddingStore.shared(path)
+        # Touch every page so RSS reflects the mapped matrix
+        df.matrix.sum()
+    # Measure once all workers hold the data so shared pages are counted fairly
+    barrier.wait()
+    results.put(memory_kb())
+    barrier.wait()
+
+
+def run(mode, workers, path):
+    ctx = mp.get_context('fork')
+    if mode == 'shared':
+        # The preloading master creates the segment before forking workers
+        master_store = EmbeddingStore.shared(path)
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(mode, path, barrier, results)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    usages = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    return usages
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    path = sys.argv[2] if len(sys.argv) > 2 else EMBEDDINGS_PATH
+
+    for mode in ('dataframe', 'shared'):
+        usages = run(mode, workers, path)
+        rss = [u['rss'] / 1024 for u in usages]
+        pss = [u['pss'] / 1024 for u in usages]
+        print(f"{mode}: {workers} workers")
+        print(f"  RSS per worker: {sum(rss) / workers:.1f} MiB (max {max(rss):.1f} MiB)")
+        print(f"  PSS per worker: {sum(pss) / workers:.1f} MiB, total {sum(pss):.1f} MiB")
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class OpenAIUnavailable(Exception):
+    pass
+
+
+class CircuitOpen(OpenAIUnavailable):
+    pass
+
+
+class DeadlineExceeded(OpenAIUnavailable):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def stage(self, share: float) -> float:
+        # Time allowed for a stage that should use `share` of what is left
+        return self.remaining() * share
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            # Once the reset timeout passes, let a single trial call through
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def record_abandoned(self):
+        # The caller ran out of time, which says nothing about OpenAI; only
+        # hand back a half-open trial so the next call can make it
+        with self._lock:
+            self._trial_running = False
+
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='openai')
+
+# An attempt with less time than this can't succeed even against a healthy
+# API, so it is not started
+MIN_ATTEMPT_SECONDS = 0.25
+
+
+def resilient_call(
+    fn, breaker: CircuitBreaker, timeout: float, attempts: int = 2, hedge_after: float = None,
+    min_attempt: float = MIN_ATTEMPT_SECONDS,
+):
+    # Runs fn(attempt_timeout) within `timeout` seconds. A failed attempt is
+    # retried and, with hedge_after set, a slow one is raced by a second
+    # attempt; whichever succeeds first wins. At most `attempts` are started.
+    # Only errors raised by the attempts count against the breaker: running
+    # out of the caller's budget is local congestion, not an OpenAI failure.
+    if timeout < min_attempt:
+        raise DeadlineExceeded(f"Only {timeout:.2f}s left in the budget for the OpenAI call")
+    if not breaker.allow():
+        raise CircuitOpen("OpenAI circuit breaker is open")
+
+    deadline = time.monotonic() + timeout
+    pending = set()
+    launched = 0
+    last_error = None
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            breaker.record_abandoned()
+            raise DeadlineExceeded(f"OpenAI call did not finish within {timeout:.2f}s")
+
+        if not pending:
+            if launched >= attempts or (launched and remaining < min_attempt):
+                breaker.record_failure()
+                raise last_error
+            pending.add(_executor.submit(fn, remaining))
+            launched += 1
+
+        can_hedge = hedge_after is not None and launched < attempts
+        done, pending = wait(pending, timeout=min(remaining, hedge_after) if can_hedge else remaining, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                breaker.record_success()
+                return future.result()
+            last_error = future.exception()
+
+        if not done and can_hedge:
+            remaining = deadline - time.monotonic()
+            if remaining >= min_attempt:
+                pending.add(_executor.submit(fn, remaining))
+                launched += 1
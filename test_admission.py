@@ -0,0 +1,122 @@
+import time
+import threading
+
+from admission import AdmissionController, TokenBucket
+
+
+def hold_slot(controller, channel, started, release, results):
+    with controller.slot(channel, timeout=5) as admitted:
+        results.append((channel, admitted))
+        started.set()
+        release.wait(5)
+
+
+def wait_for_queue(controller, length):
+    deadline = time.monotonic() + 2
+    while controller.stats()['waiting'] < length:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_voice_is_served_before_queued_email():
+    controller = AdmissionController(max_concurrent=1, max_queue=4)
+    started, release = threading.Event(), threading.Event()
+    results = []
+    holder = threading.Thread(target=hold_slot, args=(controller, 'whatsapp', started, release, results))
+    holder.start()
+    started.wait(2)
+
+    # Email queues first, voice arrives later but jumps ahead of it
+    waiters = []
+    for channel, queued in (('email', 1), ('voice', 2)):
+        waiter = threading.Thread(target=hold_slot, args=(controller, channel, threading.Event(), release, results))
+        waiter.start()
+        waiters.append(waiter)
+        wait_for_queue(controller, queued)
+
+    release.set()
+    for thread in [holder, *waiters]:
+        thread.join()
+    assert [channel for channel, _ in results] == ['whatsapp', 'voice', 'email']
+    assert all(admitted for _, admitted in results)
+
+
+def test_sheds_when_queue_is_full():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+    results = []
+    holder = threading.Thread(target=hold_slot, args=(controller, 'voice', started, release, results))
+    holder.start()
+    started.wait(2)
+    waiter = threading.Thread(target=hold_slot, args=(controller, 'voice', threading.Event(), release, results))
+    waiter.start()
+    wait_for_queue(controller, 1)
+
+    began = time.monotonic()
+    with controller.slot('voice', timeout=5) as admitted:
+        assert not admitted
+    assert time.monotonic() - began < 0.5
+    assert controller.stats()['shed'] == 1
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert controller.stats()['active'] == 0
+
+
+def test_queued_request_times_out():
+    controller = AdmissionController(max_concurrent=1, max_queue=4)
+    started, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=hold_slot, args=(controller, 'voice', started, release, []))
+    holder.start()
+    started.wait(2)
+
+    began = time.monotonic()
+    with controller.slot('voice', timeout=0.1) as admitted:
+        assert not admitted
+    assert 0.1 <= time.monotonic() - began < 1
+    assert controller.stats()['waiting'] == 0
+
+    release.set()
+    holder.join()
+
+
+def test_slot_is_released_on_error():
+    controller = AdmissionController(max_concurrent=1)
+    try:
+        with controller.slot('voice') as admitted:
+            assert admitted
+            raise RuntimeError("handler failed")
+    except RuntimeError:
+        pass
+    with controller.slot('voice', timeout=0) as admitted:
+        assert admitted
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take()
+    time.sleep(0.15)
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_sender_limit_is_per_sender():
+    controller = AdmissionController(sender_rate=0.01, sender_burst=2)
+    assert controller.allow_sender('a')
+    assert controller.allow_sender('a')
+    assert not controller.allow_sender('a')
+    assert controller.allow_sender('b')
+    assert controller.stats()['rate_limited'] == 1
+
+
+def test_reserve_sender_queues_behind_earlier_reservations():
+    controller = AdmissionController(sender_rate=10, sender_burst=1)
+    delays = [controller.reserve_sender('a') for _ in range(3)]
+    assert delays[0] == 0
+    assert 0.09 < delays[1] <= 0.1
+    assert 0.19 < delays[2] <= 0.2
+    assert not controller.allow_sender('a')
+    assert controller.stats()['delayed'] == 2
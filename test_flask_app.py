@@ -24,8 +24,18 @@ def test_send_email():
     response = requests.post(f"{base_url}/send-email", json={"email": "test@example.com"})
     print("Send Email Response:", response.json())
 
+def test_admission_stats():
+    response = requests.get(f"{base_url}/admission-stats")
+    print("Admission Stats Response:", response.json())
+
+def test_knowledge_base():
+    response = requests.get(f"{base_url}/knowledge-base")
+    print("Knowledge Base Response:", response.json())
+
 if __name__ == "__main__":
     test_ivr()
     test_send_whatsapp()
     test_call_user()
     test_send_email()
+    test_admission_stats()
+    test_knowledge_base()
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import pytest
+
+from idempotency import IdempotencyCache
+
+
+def slow(result, seconds, calls):
+    def compute():
+        calls.append(result)
+        time.sleep(seconds)
+        return result
+    return compute
+
+
+def test_duplicate_waits_and_replays():
+    cache = IdempotencyCache()
+    calls = []
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow('first', 0.2, calls))))
+    first.start()
+    time.sleep(0.05)
+
+    assert cache.get_or_compute('k', slow('second', 0, calls)) == 'first'
+    first.join()
+    assert results == ['first']
+    assert calls == ['first']
+    assert cache.stats()['waited'] == 1
+
+
+def test_completed_response_is_replayed():
+    cache = IdempotencyCache()
+    calls = []
+    assert cache.get_or_compute('k', slow('first', 0, calls)) == 'first'
+    assert cache.get_or_compute('k', slow('second', 0, calls)) == 'first'
+    assert calls == ['first']
+    assert cache.stats()['replayed'] == 1
+
+
+def test_failure_is_not_cached():
+    cache = IdempotencyCache()
+
+    def failing():
+        raise RuntimeError("handler failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('k', failing)
+    assert cache.get_or_compute('k', lambda: 'retried') == 'retried'
+
+
+def test_waiting_duplicate_sees_the_failure():
+    cache = IdempotencyCache()
+
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError("handler failed")
+
+    def original():
+        with pytest.raises(RuntimeError):
+            cache.get_or_compute('k', failing)
+
+    first = threading.Thread(target=original)
+    first.start()
+    time.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('k', lambda: 'unused')
+    first.join()
+
+
+def test_duplicate_wait_is_bounded():
+    cache = IdempotencyCache(ttl=300)
+    calls = []
+    first = threading.Thread(target=cache.get_or_compute, args=('k', slow('first', 0.5, calls)))
+    first.start()
+    time.sleep(0.05)
+
+    began = time.monotonic()
+    with pytest.raises(TimeoutError):
+        cache.get_or_compute('k', slow('second', 0, calls), timeout=0.1)
+    assert time.monotonic() - began < 0.3
+    assert cache.stats()['timed_out'] == 1
+    first.join()
+    assert cache.get_or_compute('k', slow('third', 0, calls)) == 'first'
+
+
+def test_entries_expire_after_ttl():
+    cache = IdempotencyCache(ttl=0.05)
+    calls = []
+    cache.get_or_compute('k', slow('first', 0, calls))
+    time.sleep(0.1)
+    assert cache.get_or_compute('k', slow('second', 0, calls)) == 'second'
+
+
+def test_entries_are_bounded():
+    cache = IdempotencyCache(max_entries=3)
+    for i in range(10):
+        cache.get_or_compute(str(i), lambda: i)
+    assert cache.stats()['entries'] <= 3
@@ -0,0 +1,76 @@
+import os
+import time
+
+import pandas as pd
+
+from knowledge_base import KnowledgeBaseManager
+
+
+class Store:
+    def __init__(self, path):
+        self.rows = pd.read_csv(path)
+        self.released = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    def release(self):
+        self.released = True
+
+
+def write_dataset(path, rows):
+    pd.DataFrame({'text': [f"row {i}" for i in range(rows)]}).to_csv(path, index=False)
+    # Make sure the version changes even on coarse mtime clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + rows * 1_000_000_000))
+
+
+def test_reload_swaps_in_new_version(tmp_path):
+    path = str(tmp_path / 'kb.csv')
+    write_dataset(path, 2)
+    manager = KnowledgeBaseManager(path, Store, poll_interval=0)
+    first = manager.active
+    assert not manager.reload()
+    assert manager.active is first
+
+    write_dataset(path, 3)
+    assert manager.reload()
+    assert manager.active.version != first.version
+    assert len(manager.active.data) == 3
+    # The old version is released, but a request holding it can still read it
+    assert first.data.released
+    assert len(first.data) == 2
+
+
+def test_failed_reload_keeps_serving_current_version(tmp_path):
+    path = str(tmp_path / 'kb.csv')
+    write_dataset(path, 2)
+    manager = KnowledgeBaseManager(path, Store, poll_interval=0.05)
+    first = manager.active
+    manager.start()
+    try:
+        with open(path, 'w') as f:
+            f.write('')
+        deadline = time.monotonic() + 2
+        while manager.last_error is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert manager.active is first
+        assert manager.status()['rows'] == 2
+    finally:
+        manager.stop()
+
+
+def test_after_fork_replaces_a_held_reload_lock(tmp_path):
+    path = str(tmp_path / 'kb.csv')
+    write_dataset(path, 2)
+    manager = KnowledgeBaseManager(path, Store, poll_interval=30)
+    # As if the watcher was mid-reload when the worker forked
+    manager._reload_lock.acquire()
+    manager.after_fork()
+    try:
+        write_dataset(path, 3)
+        assert manager.reload()
+        assert manager._thread.is_alive()
+    finally:
+        manager.stop()
@@ -0,0 +1,179 @@
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import fake_openai
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, resilient_call
+
+
+class ApiError(Exception):
+    pass
+
+
+def failing(attempt_timeout):
+    raise ApiError("server error")
+
+
+def sleeping(seconds, result='ok'):
+    def call(attempt_timeout):
+        time.sleep(seconds)
+        return result
+    return call
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_breaker_trial_success_closes():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_breaker_trial_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_errors_open_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        with pytest.raises(ApiError):
+            resilient_call(failing, breaker, timeout=1)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        resilient_call(sleeping(0), breaker, timeout=1)
+
+
+def test_failed_attempt_is_retried():
+    calls = []
+
+    def flaky(attempt_timeout):
+        calls.append(attempt_timeout)
+        if len(calls) == 1:
+            raise ApiError("server error")
+        return 'ok'
+
+    breaker = CircuitBreaker(failure_threshold=1)
+    assert resilient_call(flaky, breaker, timeout=1) == 'ok'
+    assert len(calls) == 2
+    assert breaker.state == 'closed'
+
+
+def test_short_budget_is_not_attempted():
+    breaker = CircuitBreaker(failure_threshold=1)
+    calls = []
+    with pytest.raises(DeadlineExceeded):
+        resilient_call(lambda t: calls.append(t), breaker, timeout=0.02)
+    assert calls == []
+    assert breaker.state == 'closed'
+
+
+def test_exhausted_budget_does_not_open_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=2)
+    for _ in range(3):
+        with pytest.raises(DeadlineExceeded):
+            resilient_call(sleeping(0.5), breaker, timeout=0.3)
+    assert breaker.state == 'closed'
+
+
+def test_exhausted_budget_hands_back_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    with pytest.raises(DeadlineExceeded):
+        resilient_call(sleeping(0.5), breaker, timeout=0.3)
+    assert breaker.allow()
+
+
+def test_slow_attempt_is_hedged():
+    calls = []
+
+    def first_slow(attempt_timeout):
+        calls.append(attempt_timeout)
+        time.sleep(1.0 if len(calls) == 1 else 0)
+        return len(calls)
+
+    started = time.monotonic()
+    result = resilient_call(first_slow, CircuitBreaker(), timeout=2, hedge_after=0.1)
+    assert result == 2
+    assert time.monotonic() - started < 0.5
+
+
+def test_no_hedge_without_hedge_after():
+    calls = []
+
+    def slow(attempt_timeout):
+        calls.append(attempt_timeout)
+        time.sleep(0.3)
+        return 'ok'
+
+    assert resilient_call(slow, CircuitBreaker(), timeout=2) == 'ok'
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def app_with_fake_openai(monkeypatch):
+    # ask() against fake_openai.py running in-process
+    if not os.path.exists('DATASET/emdeddings_dataset.csv'):
+        pytest.skip("needs the embeddings dataset")
+    os.environ.setdefault('OPENAI_API_KEY', 'test')
+    os.environ.setdefault('KB_POLL_SECONDS', '0')
+    import twilio.rest
+    from mock_twilio import mock_twilio_client
+    monkeypatch.setattr(twilio.rest, 'Client', lambda *args, **kwargs: mock_twilio_client)
+    import app
+    from openai import OpenAI
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), fake_openai.FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(app, 'openai_client', OpenAI(api_key='test', base_url=f"http://127.0.0.1:{server.server_port}/v1"))
+    monkeypatch.setattr(app, 'openai_breaker', CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    monkeypatch.setattr(app, 'num_tokens', lambda text, model=None: len(text.split()))
+    app.query_embedding_cache.clear()
+    yield app
+    server.shutdown()
+
+
+def test_ask_falls_back_to_referral_when_openai_fails(app_with_fake_openai, monkeypatch):
+    app = app_with_fake_openai
+    monkeypatch.setattr(fake_openai, 'FAILURE_RATE', 1.0)
+    for question in ("What trucks do you have?", "Do you cross borders?"):
+        assert app.ask(question) == app.REFERRAL_MESSAGE
+    assert app.openai_breaker.state == 'open'
+    # With the breaker open nothing reaches the API
+    assert app.ask("Where are you based?") == app.REFERRAL_MESSAGE
+
+
+def test_ask_answers_when_openai_is_healthy(app_with_fake_openai):
+    app = app_with_fake_openai
+    assert app.ask("What trucks do you have?") != app.REFERRAL_MESSAGE
+    assert app.openai_breaker.state == 'closed'